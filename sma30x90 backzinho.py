@@ -2,21 +2,41 @@
 # --------------------------------------------------
 # Requisitos:
 #   pip install streamlit pandas openpyxl xlsxwriter
+# Opcionais (aceleram SMAs e o laço da estratégia):
+#   pip install bottleneck numba python-calamine
 # Execução:
 #   streamlit run sma_strategy_app.py
 # --------------------------------------------------
+import hashlib
 import io
+import json
+import multiprocessing as mp
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+import xlsxwriter
+
+from sma_strategy import SUMMARY_FORMATS, calculate_strategy, price_column, sma, strategy_summary
 
 # --------------------------------------------------
 # Funções utilitárias
 # --------------------------------------------------
 
-def _detect_tickers(df: pd.DataFrame) -> Tuple[str, pd.DataFrame]:
+# Cache em disco dos uploads já processados: um diretório por (versão, hash do
+# arquivo), ao lado deste script. Nada é apagado automaticamente — a pasta pode
+# ser removida a qualquer momento sem perda (é só recalculada no próximo upload).
+_CACHE_DIR = pathlib.Path(__file__).resolve().parent / ".cache"
+# Incrementar sempre que _read_upload, _parse_dates, _with_smas ou sma_strategy.sma mudarem:
+# entradas de versões anteriores deixam de ser lidas.
+_CACHE_VERSION = 2
+
+
+def _detect_tickers(df: pd.DataFrame) -> Tuple[str, List[str]]:
     """Retorna modo de organização (coluna ou planilhas) e lista de tickers."""
     if "Ticker" in df.columns:  # único Sheet com coluna "Ticker"
         tickers = sorted(df["Ticker"].dropna().unique())
@@ -26,100 +46,184 @@ def _detect_tickers(df: pd.DataFrame) -> Tuple[str, pd.DataFrame]:
         return "sheet", []
 
 
-def calculate_strategy(df: pd.DataFrame, buy_usd: float, sell_usd: float,
-                        threshold_pct: float = 20.0) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Calcula SMAs, executa compras/vendas e devolve (dados, trades)."""
-    df = df.copy().sort_values("Date")
-
-    # Garantir dtype correto
-    df["Date"] = pd.to_datetime(df["Date"])
-    price_col = "Adj Close" if "Adj Close" in df.columns else "Close"
-
-    if price_col not in df.columns:
-        raise ValueError("Coluna de preço não encontrada. Esperado 'Adj Close' ou 'Close'.")
-
-    df["SMA30"] = df[price_col].rolling(window=30).mean()
-    df["SMA90"] = df[price_col].rolling(window=90).mean()
-
-    trades = []
-    shares_balance = 0.0
-    cash_from_sales = 0.0
-    total_spent = 0.0
-
-    for _, row in df.iterrows():
-        price = row[price_col]
-        sma30, sma90 = row["SMA30"], row["SMA90"]
-        if pd.isna(sma30) or pd.isna(sma90):
-            continue
-
-        # --- Vendas ---
-        if sma30 > sma90 and price >= (1 + threshold_pct / 100) * sma30:
-            shares_to_sell = sell_usd / price
-            if shares_balance >= shares_to_sell:
-                shares_balance -= shares_to_sell
-                cash_from_sales += sell_usd
-                trades.append({
-                    "Date": row["Date"],
-                    "Action": "Sell",
-                    "USD_Value": sell_usd,
-                    "Shares_Amount": shares_to_sell,
-                    "Shares_Balance": shares_balance,
-                    "Holding_Value_USD": shares_balance * price,
-                    "USD_Spent_on_Buys": 0,
-                    "USD_from_Sales": sell_usd,
-                })
-
-        # --- Compras ---
-        elif sma30 < sma90:
-            shares_to_buy = buy_usd / price
-            shares_balance += shares_to_buy
-            total_spent += buy_usd
-            trades.append({
-                "Date": row["Date"],
-                "Action": "Buy",
-                "USD_Value": buy_usd,
-                "Shares_Amount": shares_to_buy,
-                "Shares_Balance": shares_balance,
-                "Holding_Value_USD": shares_balance * price,
-                "USD_Spent_on_Buys": buy_usd,
-                "USD_from_Sales": 0,
-            })
-
-    trades_df = pd.DataFrame(trades)
-
-    # Resumo
-    total_buys = trades_df[trades_df["Action"] == "Buy"].shape[0]
-    total_sells = trades_df[trades_df["Action"] == "Sell"].shape[0]
-    total_shares_bought = trades_df.loc[trades_df["Action"] == "Buy", "Shares_Amount"].sum()
-    avg_price_paid = total_spent / total_shares_bought if total_shares_bought else None
-    pnl = cash_from_sales - total_spent
-    last_price = df[price_col].iloc[-1]
-    holding_value = shares_balance * last_price
-    market_pnl = cash_from_sales + holding_value - total_spent
-    market_pnl_pct = market_pnl / total_spent * 100 if total_spent else 0
-
-    summary = pd.DataFrame({
-        "Métrica": [
-            "Total de compras", "Total gasto em compras (USD)", "Total de ações compradas",
-            "Preço médio pago (USD/ação)", "Total de vendas", "USD gerado em vendas",
-            "Caixa – (compras - vendas)", "Valor de mercado do saldo de ações",
-            "P&L total (USD)", "% de lucro/prejuízo total"
-        ],
-        "Valor": [
-            total_buys,
-            f"${total_spent:,.2f}",
-            f"{total_shares_bought:.4f}",
-            f"${avg_price_paid:,.2f}" if avg_price_paid else "N/A",
-            total_sells,
-            f"${cash_from_sales:,.2f}",
-            f"${cash_from_sales - total_spent:,.2f}",
-            f"${holding_value:,.2f}",
-            f"${market_pnl:,.2f}",
-            f"{market_pnl_pct:.2f}%",
-        ]
+def _parse_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte ``Date`` para datetime64 (ISO 8601, com cache de strings repetidas)."""
+    if "Date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["Date"]):
+        try:
+            df["Date"] = pd.to_datetime(df["Date"], format="ISO8601", cache=True)
+        except (ValueError, TypeError):
+            pass  # formato fora do ISO; calculate_strategy infere e reporta o erro
+    return df
+
+
+def _with_smas(df: pd.DataFrame) -> pd.DataFrame:
+    """Ordena por data e anexa ``_sma30``/``_sma90`` (float64) para ``calculate_strategy``.
+
+    Nomes privados de propósito: colunas SMA30/SMA90 vindas do arquivo do
+    usuário nunca são confundidas com as calculadas aqui.
+    """
+    if price_column(df) not in df.columns or not pd.api.types.is_datetime64_any_dtype(df.get("Date")):
+        return df  # calculate_strategy infere/valida e reporta o erro
+    df = df.sort_values("Date", kind="stable", ignore_index=True)
+    price = df[price_column(df)].to_numpy(dtype=np.float64)
+    return df.assign(_sma30=sma(price, 30), _sma90=sma(price, 90))
+
+
+def _read_disk_cache(key: str) -> Optional[Tuple[str, Dict[str, pd.DataFrame]]]:
+    """(modo, {ticker: df}) gravado por ``_write_disk_cache``, ou None se não houver."""
+    folder = _CACHE_DIR / key
+    try:
+        index = json.loads((folder / "index.json").read_text(encoding="utf-8"))
+        frames = {tkr: pd.read_parquet(folder / f"{i}.parquet")
+                  for i, tkr in enumerate(index["tickers"])}
+    except (OSError, ValueError, ImportError):
+        return None
+    return index["mode"], frames
+
+
+def _write_disk_cache(key: str, mode: str, frames: Dict[str, pd.DataFrame]) -> None:
+    """Grava um Parquet por ticker; o index.json vai por último e marca o cache como completo."""
+    folder = _CACHE_DIR / key
+    try:
+        folder.mkdir(parents=True, exist_ok=True)
+        for i, df in enumerate(frames.values()):
+            df.to_parquet(folder / f"{i}.parquet", compression="zstd")
+        index = {"mode": mode, "tickers": list(frames)}
+        (folder / "index.json").write_text(json.dumps(index), encoding="utf-8")
+    except (OSError, ValueError, TypeError, ImportError):
+        pass  # cache em disco é só otimização (sem pyarrow, sem escrita, colunas mistas…)
+
+
+def _read_upload(file_bytes: bytes, name: str) -> Tuple[str, Dict[str, pd.DataFrame]]:
+    """Lê o upload e devolve (modo, {ticker: df}).
+
+    Modos: "sheet" (uma sheet por ticker), "column" (coluna ``Ticker``, já
+    separada por ticker) ou "single" (CSV de um único ativo, chave "__csv__").
+    """
+    buffer = io.BytesIO(file_bytes)
+    if name.endswith((".xlsx", ".xls")):
+        try:  # calamine (Rust) é bem mais rápido que o openpyxl
+            sheets = pd.read_excel(buffer, sheet_name=None, engine="calamine")
+        except (ImportError, ValueError):  # python-calamine ausente ou pandas < 2.2
+            buffer.seek(0)
+            sheets = pd.read_excel(buffer, sheet_name=None)
+        first = next(iter(sheets.values()))
+    else:  # CSV simples – precisa ter coluna Ticker ou apenas um ativo
+        sheets = None
+        first = pd.read_csv(buffer)
+
+    mode, tickers = _detect_tickers(first)
+    if mode == "column":
+        # Um único groupby aqui evita refiltrar o arquivo inteiro a cada rerun
+        groups = dict(list(_parse_dates(first).groupby("Ticker", sort=False)))
+        return mode, {tkr: groups[tkr].reset_index(drop=True) for tkr in tickers}
+    if sheets is None:
+        return "single", {"__csv__": _parse_dates(first)}
+    return mode, {sheet: _parse_dates(df) for sheet, df in sheets.items()}
+
+
+@st.cache_data(show_spinner=False)
+def _load_file(file_bytes: bytes, name: str) -> Tuple[str, Dict[str, pd.DataFrame]]:
+    """``_read_upload`` + SMAs, em cache na sessão e em disco (Parquet) por hash do arquivo."""
+    key = f"v{_CACHE_VERSION}-{hashlib.sha256(file_bytes).hexdigest()[:16]}"
+    cached = _read_disk_cache(key)
+    if cached is not None:
+        return cached
+
+    mode, frames = _read_upload(file_bytes, name)
+    frames = {tkr: _with_smas(df) for tkr, df in frames.items()}
+    _write_disk_cache(key, mode, frames)
+    return mode, frames
+
+
+def _format_summary(summary: pd.DataFrame) -> pd.DataFrame:
+    """Resumo com ``Valor`` formatado para exibição (N/A quando indefinido)."""
+    values = [
+        SUMMARY_FORMATS[metric][0].format(value) if pd.notna(value) else "N/A"
+        for metric, value in zip(summary["Métrica"], summary["Valor"])
+    ]
+    return summary.assign(Valor=values)
+
+
+def _write_sheet(worksheet, df: pd.DataFrame, header) -> None:
+    """Escreve ``df`` linha a linha (ordem exigida pelo modo constant_memory)."""
+    write_row = worksheet.write_row  # método em variável local: evita lookup por linha
+    write_row(0, 0, list(df.columns), header)
+    for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        write_row(r, 0, [None if v != v else v for v in row])  # NaN/NaT → vazio
+
+
+def _results_to_excel(df_calc: pd.DataFrame, trades: pd.DataFrame, summary: pd.DataFrame) -> bytes:
+    """Gera o xlsx de resultados em streaming, com o resumo em números formatados."""
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "remove_timezone": True,
     })
+    header = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    _write_sheet(workbook.add_worksheet("Dados_SMAs"), df_calc, header)
+    _write_sheet(workbook.add_worksheet("Trades"), trades, header)
+
+    worksheet = workbook.add_worksheet("Resumo")
+    num_formats = {fmt: workbook.add_format({"num_format": fmt})
+                   for _, fmt in SUMMARY_FORMATS.values()}
+    worksheet.set_column(0, 0, 36)
+    worksheet.set_column(1, 1, 16)
+    worksheet.write_row(0, 0, list(summary.columns), header)
+    for r, (metric, value) in enumerate(zip(summary["Métrica"], summary["Valor"]), start=1):
+        worksheet.write_string(r, 0, metric)
+        if pd.notna(value):
+            worksheet.write_number(r, 1, value, num_formats[SUMMARY_FORMATS[metric][1]])
+        else:
+            worksheet.write_string(r, 1, "N/A")
+
+    workbook.close()
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False)
+def _cached_strategy(df: pd.DataFrame, buy_usd: float, sell_usd: float,
+                     threshold_pct: float) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """``calculate_strategy`` memoizado por (conteúdo do df, parâmetros)."""
+    return calculate_strategy(df, buy_usd, sell_usd, threshold_pct)
+
+
+def _backtest_all(frames: Dict[str, pd.DataFrame], buy_usd: float, sell_usd: float,
+                  threshold_pct: float, on_progress: Optional[Callable[[float], object]] = None
+                  ) -> Dict[str, Union[pd.DataFrame, Exception]]:
+    """Roda o back‑test de todos os tickers em paralelo e devolve {ticker: resumo ou erro}."""
+    # Nada de "fork": o servidor do Streamlit tem várias threads e um fork pode
+    # herdar locks presos. Os workers só importam sma_strategy (sem Streamlit);
+    # com forkserver o módulo é pré-carregado uma vez, senão cai no spawn.
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(["sma_strategy"])
+    else:
+        ctx = mp.get_context("spawn")
 
-    return df, trades_df, summary
+    results = {}
+    with ProcessPoolExecutor(mp_context=ctx) as executor:
+        futures = {}
+        for tkr, df in frames.items():
+            try:  # só os arrays de data e preço vão para os workers
+                dates = df["Date"].to_numpy()
+                price = df[price_column(df)].to_numpy(dtype=np.float64)
+            except KeyError as e:
+                results[tkr] = ValueError(f"Coluna não encontrada: {e}")
+                continue
+            future = executor.submit(strategy_summary, dates, price, buy_usd, sell_usd, threshold_pct)
+            futures[future] = tkr
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+            if on_progress is not None:
+                on_progress(done / len(futures))
+
+    return {tkr: results[tkr] for tkr in frames}
 
 # --------------------------------------------------
 # Interface Streamlit
@@ -131,27 +235,18 @@ st.title("📈 SMA\_30 / SMA\_90 Strategy Back‑Tester")
 uploaded_file = st.file_uploader("Faça upload de um arquivo Excel (até várias folhas ou com coluna 'Ticker')", type=["xlsx", "xls", "csv"])
 
 if uploaded_file:
-    # Carregamento flexível (Excel ou CSV)
-    if uploaded_file.name.endswith((".xlsx", ".xls")):
-        xls = pd.ExcelFile(uploaded_file)
-        mode, tickers = _detect_tickers(pd.read_excel(xls, xls.sheet_names[0]))
-
-        if mode == "sheet":
-            tickers = xls.sheet_names
-            choice = st.selectbox("Escolha o ticker (nome da sheet)", tickers)
-            df_raw = pd.read_excel(xls, sheet_name=choice)
-        else:
-            choice = st.selectbox("Escolha o ticker", tickers)
-            df_raw = pd.read_excel(xls, sheet_name=xls.sheet_names[0])
-            df_raw = df_raw[df_raw["Ticker"] == choice]
-    else:  # CSV simples – precisa ter coluna Ticker ou apenas um ativo
-        df_raw = pd.read_csv(uploaded_file)
-        if "Ticker" in df_raw.columns:
-            tickers = sorted(df_raw["Ticker"].unique())
-            choice = st.selectbox("Escolha o ticker", tickers)
-            df_raw = df_raw[df_raw["Ticker"] == choice]
-        else:
-            choice = st.text_input("Ticker (informativo)", value="N/A")
+    # Carregamento flexível (Excel ou CSV), em cache entre reruns
+    mode, frames = _load_file(uploaded_file.getvalue(), uploaded_file.name)
+
+    if mode == "sheet":
+        choice = st.selectbox("Escolha o ticker (nome da sheet)", list(frames))
+        df_raw = frames[choice]
+    elif mode == "column":
+        choice = st.selectbox("Escolha o ticker", list(frames))
+        df_raw = frames[choice]
+    else:
+        choice = st.text_input("Ticker (informativo)", value="N/A")
+        df_raw = frames["__csv__"]
 
     # Parametrização
     st.subheader("Parâmetros da estratégia")
@@ -163,31 +258,54 @@ if uploaded_file:
     with col3:
         threshold_pct = st.number_input("% acima da SMA30 para vender", min_value=1.0, value=20.0, step=1.0)
 
+    # CSV (só os trades) é bem mais rápido e leve que o xlsx completo
+    export_format = st.radio("Formato do download", ["CSV (trades)", "Excel (completo)"], horizontal=True)
+
     if st.button("Executar back‑test"):
         try:
-            df_calc, trades, summary = calculate_strategy(df_raw, buy_usd, sell_usd, threshold_pct)
+            df_calc, trades, summary = _cached_strategy(df_raw, buy_usd, sell_usd, threshold_pct)
 
             st.success("✅ Estratégia executada com sucesso!")
             st.subheader("Resumo")
-            st.dataframe(summary, use_container_width=True)
+            st.dataframe(_format_summary(summary), use_container_width=True)
 
             st.subheader("Trades")
             st.dataframe(trades, use_container_width=True)
 
-            # Download do Excel
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-                df_calc.to_excel(writer, sheet_name="Dados_SMAs", index=False)
-                trades.to_excel(writer, sheet_name="Trades", index=False)
-                summary.to_excel(writer, sheet_name="Resumo", index=False)
-            st.download_button(
-                label="📥 Baixar resultados (Excel)",
-                data=buffer.getvalue(),
-                file_name=f"backtest_{choice}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
+            # Download: só gera o formato escolhido
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            if export_format == "CSV (trades)":
+                st.download_button(
+                    label="📥 Baixar trades (CSV)",
+                    data=trades.to_csv(index=False).encode("utf-8"),
+                    file_name=f"trades_{choice}_{stamp}.csv",
+                    mime="text/csv",
+                )
+            else:
+                st.download_button(
+                    label="📥 Baixar resultados (Excel)",
+                    data=_results_to_excel(df_calc, trades, summary),
+                    file_name=f"backtest_{choice}_{stamp}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
         except Exception as e:
             st.error(f"Erro ao executar a estratégia: {e}")
 
+    if mode != "single" and st.button("Executar para todos os tickers"):
+        progress = st.progress(0.0, text="Executando back‑tests…")
+        results = _backtest_all(frames, buy_usd, sell_usd, threshold_pct, progress.progress)
+        progress.empty()
+
+        summaries = {}
+        for tkr, result in results.items():
+            if isinstance(result, Exception):
+                st.warning(f"{tkr}: {result}")
+            else:
+                summaries[tkr] = _format_summary(result).set_index("Métrica")["Valor"]
+
+        if summaries:
+            st.subheader("Resumo por ticker")
+            st.dataframe(pd.concat(summaries, axis=1), use_container_width=True)
+
 else:
     st.info("⬆️ Faça upload de um arquivo Excel ou CSV para começar.")
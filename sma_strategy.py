@@ -0,0 +1,228 @@
+# Núcleo da estratégia SMA30×90 (sem Streamlit)
+# --------------------------------------------------
+# Módulo separado do app para que os processos do back-test de todos os
+# tickers (forkserver/spawn, que não herdam o script) possam importá-lo.
+# --------------------------------------------------
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+try:  # média móvel em C; sem ele caímos no rolling do pandas
+    import bottleneck as bn
+except ImportError:
+    bn = None
+
+try:  # kernel compilado da estratégia; sem numba usamos a versão NumPy
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Métricas do resumo → (formato na tela, number format no Excel)
+SUMMARY_FORMATS = {
+    "Total de compras": ("{:.0f}", "0"),
+    "Total gasto em compras (USD)": ("${:,.2f}", '"$"#,##0.00'),
+    "Total de ações compradas": ("{:.4f}", "0.0000"),
+    "Preço médio pago (USD/ação)": ("${:,.2f}", '"$"#,##0.00'),
+    "Total de vendas": ("{:.0f}", "0"),
+    "USD gerado em vendas": ("${:,.2f}", '"$"#,##0.00'),
+    "Caixa – (compras - vendas)": ("${:,.2f}", '"$"#,##0.00'),
+    "Valor de mercado do saldo de ações": ("${:,.2f}", '"$"#,##0.00'),
+    "P&L total (USD)": ("${:,.2f}", '"$"#,##0.00'),
+    "% de lucro/prejuízo total": ("{:.2f}%", '0.00"%"'),
+}
+
+
+def price_column(df: pd.DataFrame) -> str:
+    """Coluna de preço usada na estratégia ('Adj Close' quando existir)."""
+    return "Adj Close" if "Adj Close" in df.columns else "Close"
+
+
+def sma(prices: np.ndarray, window: int) -> np.ndarray:
+    """Média móvel simples de ``window`` períodos (NaN até completar a janela)."""
+    if len(prices) < window:  # histórico curto: só aquecimento
+        return np.full(len(prices), np.nan)
+    if bn is not None:
+        return bn.move_mean(prices, window=window, min_count=window)
+    return pd.Series(prices).rolling(window=window).mean().to_numpy()
+
+
+def _strategy_numpy(price: np.ndarray, inv_price: np.ndarray, sma30: np.ndarray,
+                    sma90: np.ndarray, sell_trigger: np.ndarray,
+                    buy_usd: float, sell_usd: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Versão NumPy do kernel: devolve (posições dos trades, ações 0=compra/1=venda)."""
+    # Sinais vetorizados (comparações com NaN são sempre falsas)
+    buy_mask = sma30 < sma90
+    sell_cond = (sma30 > sma90) & (price >= sell_trigger)
+
+    # --- Compras --- independentes entre si: o saldo comprado é uma soma acumulada
+    buy_shares = np.where(buy_mask, buy_usd * inv_price, 0.0)
+    cum_buy_shares = buy_shares.cumsum()
+
+    # --- Vendas --- dependem do saldo anterior; percorremos só os candidatos
+    sold = []
+    shares_sold = 0.0
+    candidates = np.flatnonzero(sell_cond)
+    for i, cand_inv_price, bought in zip(candidates.tolist(), inv_price[candidates].tolist(),
+                                         cum_buy_shares[candidates].tolist()):
+        shares_to_sell = sell_usd * cand_inv_price
+        if bought - shares_sold >= shares_to_sell:
+            shares_sold += shares_to_sell
+            sold.append(i)
+
+    sell_mask = np.zeros(len(price), dtype=bool)
+    sell_mask[sold] = True
+
+    trade_idx = np.flatnonzero(buy_mask | sell_mask)
+    return trade_idx, sell_mask[trade_idx].astype(np.int8)
+
+
+def _strategy_loop(price: np.ndarray, inv_price: np.ndarray, sma30: np.ndarray,
+                   sma90: np.ndarray, sell_trigger: np.ndarray,
+                   buy_usd: float, sell_usd: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Kernel sequencial (compilado com numba): mesmo retorno de ``_strategy_numpy``."""
+    n = price.shape[0]
+    trade_idx = np.empty(n, dtype=np.int64)
+    actions = np.empty(n, dtype=np.int8)
+    shares_balance = 0.0
+    k = 0
+
+    for i in range(n):
+        s30, s90 = sma30[i], sma90[i]
+
+        # --- Vendas ---
+        if s30 > s90 and price[i] >= sell_trigger[i]:
+            shares_to_sell = sell_usd * inv_price[i]
+            if shares_balance >= shares_to_sell:
+                shares_balance -= shares_to_sell
+                trade_idx[k], actions[k] = i, 1
+                k += 1
+
+        # --- Compras ---
+        elif s30 < s90:
+            shares_balance += buy_usd * inv_price[i]
+            trade_idx[k], actions[k] = i, 0
+            k += 1
+
+    return trade_idx[:k], actions[:k]
+
+
+_run_strategy = njit(cache=True)(_strategy_loop) if njit is not None else _strategy_numpy
+
+
+def calculate_strategy(df: pd.DataFrame, buy_usd: float, sell_usd: float,
+                        threshold_pct: float = 20.0) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Calcula SMAs, executa compras/vendas e devolve (dados, trades, resumo)."""
+    # Garantir dtype correto (normalmente já convertido em _load_file)
+    dates = df["Date"]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, cache=True)
+
+    price_col = price_column(df)
+
+    if price_col not in df.columns:
+        raise ValueError("Coluna de preço não encontrada. Esperado 'Adj Close' ou 'Close'.")
+
+    # Trabalha só com arrays: o df de entrada nunca é copiado nem alterado.
+    # Séries de preço costumam vir ordenadas: só reordena quando preciso
+    presorted = dates.is_monotonic_increasing
+    dates = dates.to_numpy()
+    price = df[price_col].to_numpy(dtype=np.float64)
+    if not presorted:
+        order = np.argsort(dates, kind="stable")
+        dates, price = dates[order], price[order]
+
+    if presorted and "_sma30" in df.columns and "_sma90" in df.columns:
+        # Já calculadas por _with_smas (no load ou lidas do cache em disco)
+        sma30 = df["_sma30"].to_numpy(dtype=np.float64)
+        sma90 = df["_sma90"].to_numpy(dtype=np.float64)
+    else:
+        sma30 = sma(price, 30)
+        sma90 = sma(price, 90)
+
+    # Pula o aquecimento (SMA90 NaN até fechar a janela); NaNs posteriores,
+    # de preços faltantes, já não disparam sinais
+    warmup = np.isnan(sma90)
+    start = len(price) if warmup.all() else int(warmup.argmin())
+    # Invariantes do laço calculados uma vez: gatilho de venda e 1/preço
+    inv_price = 1.0 / price
+    sell_trigger = (1.0 + threshold_pct / 100.0) * sma30[start:]
+    trade_idx, actions = _run_strategy(
+        price[start:], inv_price[start:], sma30[start:], sma90[start:], sell_trigger,
+        float(buy_usd), float(sell_usd))
+    trade_idx = trade_idx + start
+
+    is_sell = actions == 1
+    trade_price = price[trade_idx]
+    trade_usd = np.where(is_sell, sell_usd, buy_usd)
+    trade_shares = trade_usd * inv_price[trade_idx]
+
+    # Saldo e valor em carteira derivados depois do kernel: soma acumulada com sinal
+    trade_balance = np.where(is_sell, -trade_shares, trade_shares).cumsum()
+    shares_balance = trade_balance[-1] if len(trade_balance) else 0.0
+
+    trades_df = pd.DataFrame({
+        "Date": dates[trade_idx],
+        "Action": pd.Categorical.from_codes(actions, categories=["Buy", "Sell"]),
+        "USD_Value": trade_usd,
+        "Shares_Amount": trade_shares,
+        "Shares_Balance": trade_balance,
+        "Holding_Value_USD": trade_balance * trade_price,
+        "USD_Spent_on_Buys": np.where(is_sell, 0.0, buy_usd),
+        "USD_from_Sales": np.where(is_sell, sell_usd, 0.0),
+    })
+
+    # Resumo
+    # Uma única agregação; observed=False mantém Buy/Sell mesmo sem trades
+    agg = trades_df.groupby("Action", observed=False).agg(
+        n=("Action", "size"), shares=("Shares_Amount", "sum"), usd=("USD_Value", "sum"))
+    total_buys = int(agg.loc["Buy", "n"])
+    total_sells = int(agg.loc["Sell", "n"])
+    total_shares_bought = agg.loc["Buy", "shares"]
+    total_spent = agg.loc["Buy", "usd"]
+    cash_from_sales = agg.loc["Sell", "usd"]
+    avg_price_paid = total_spent / total_shares_bought if total_shares_bought else np.nan
+    pnl = cash_from_sales - total_spent
+    last_price = price[-1]
+    holding_value = shares_balance * last_price
+    market_pnl = cash_from_sales + holding_value - total_spent
+    market_pnl_pct = market_pnl / total_spent * 100 if total_spent else 0
+
+    # Valores numéricos; a formatação fica para a tela / Excel (SUMMARY_FORMATS)
+    summary = pd.DataFrame({
+        "Métrica": list(SUMMARY_FORMATS),
+        "Valor": [
+            total_buys,
+            total_spent,
+            total_shares_bought,
+            avg_price_paid,
+            total_sells,
+            cash_from_sales,
+            cash_from_sales - total_spent,
+            holding_value,
+            market_pnl,
+            market_pnl_pct,
+        ]
+    })
+
+    # Saída em float32 (precisão limitada pelo preço); os sinais usaram float64
+    df_calc = pd.DataFrame({
+        "Date": dates,
+        price_col: price,
+        "SMA30": sma30.astype(np.float32),
+        "SMA90": sma90.astype(np.float32),
+    })
+
+    return df_calc, trades_df, summary
+
+
+def strategy_summary(dates: np.ndarray, price: np.ndarray, buy_usd: float,
+                     sell_usd: float, threshold_pct: float) -> pd.DataFrame:
+    """Só o resumo de ``calculate_strategy`` a partir dos arrays de data e preço.
+
+    Usado nos workers do back-test de todos os tickers: arrays NumPy são
+    serializados bem mais rápido que DataFrames entre processos.
+    """
+    df = pd.DataFrame({"Date": dates, "Close": price})
+    return calculate_strategy(df, buy_usd, sell_usd, threshold_pct)[2]